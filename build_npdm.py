@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 
 import argparse
+import dataclasses
 import enum
-import json
+import os
 import struct
 import sys
+import threading
 import typing
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 
 def abort(msg: str):
     print(f"error: {msg}", file=sys.stderr)
@@ -17,62 +24,174 @@ def abort_unless(cond: bool, msg: str):
         abort(msg)
 
 
+def align_up(value: int, alignment: int) -> int:
+    return value + (-value % alignment)
+
+def write_file(filename: str, data: memoryview):
+    # unbuffered: the whole file goes out in (usually) a single write syscall
+    # O_BINARY stops Windows from translating newlines; 0o666 matches open()
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(filename, flags, 0o666)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+    finally:
+        os.close(fd)
+
+
 class ByteOrder(enum.Enum):
     little = "<"
     big = ">"
 
+_SCALAR_FORMATS = "?bBhHiIqQfd"
+_LE = {fmt: struct.Struct("<" + fmt) for fmt in _SCALAR_FORMATS}
+_BE = {fmt: struct.Struct(">" + fmt) for fmt in _SCALAR_FORMATS}
+
+_ZERO_CHUNK = memoryview(bytes(0x10000))
+
 class BinaryWriter:
+    __slots__ = (
+        "_buf", "_size", "byte_order", "_position",
+        "_endian", "_int_order", "_structs",
+        "_pack_u8", "_pack_u16", "_pack_u32", "_pack_u64", "_pooled",
+    )
+
+    _local = threading.local()
+
     def __init__(self, size: int = 0, byte_order: ByteOrder = ByteOrder.little):
-        self.stream = bytearray(size)
+        # `_buf` may run past the logical end (reserved or not yet trimmed),
+        # but everything after it is always zero
+        self._buf = bytearray(size)
+        self._size = size
         self.byte_order = byte_order
         self._position = 0
+        self._endian = byte_order.value
+        self._int_order = byte_order.name
+        self._structs = _LE if byte_order is ByteOrder.little else _BE
+        self._pack_u8 = self._structs["B"].pack_into
+        self._pack_u16 = self._structs["H"].pack_into
+        self._pack_u32 = self._structs["I"].pack_into
+        self._pack_u64 = self._structs["Q"].pack_into
+        self._pooled = False
+
+    @classmethod
+    def _free_list(cls) -> list[typing.Self]:
+        # one free list per thread, so acquire/release need no locking
+        free_list = getattr(cls._local, "writers", None)
+        if free_list is None:
+            free_list = cls._local.writers = []
+        return free_list
+
+    @classmethod
+    def acquire(cls) -> typing.Self:
+        # reuse a released (little endian) writer and its buffer if there is one
+        try:
+            writer = cls._free_list().pop()
+        except IndexError:
+            return cls()
+        writer._pooled = False
+        return writer
+
+    def release(self):
+        if self._pooled:
+            raise RuntimeError("BinaryWriter released twice")
+        if self.byte_order is not ByteOrder.little:
+            raise RuntimeError("only little endian writers are pooled")
+
+        # only the written range can be non-zero, the rest of the buffer already is
+        used = min(self.size, len(self._buf))
+        with memoryview(self._buf) as view:
+            for start in range(0, used, len(_ZERO_CHUNK)):
+                stop = min(start + len(_ZERO_CHUNK), used)
+                view[start:stop] = _ZERO_CHUNK[:stop - start]
+
+        self._size = 0
+        self._position = 0
+        self._pooled = True
+        self._free_list().append(self)
 
     @property
     def position(self) -> int:
         return self._position
 
+    @property
+    def size(self) -> int:
+        return max(self._size, self._position)
+
+    @property
+    def stream(self) -> bytearray:
+        size = self.size
+        if len(self._buf) > size:
+            del self._buf[size:]
+        else:
+            self._fill_bytes(size, relative=False)
+        return self._buf
+
+    def reserve(self, size: int):
+        self._fill_bytes(size, relative=False)
+
+    def getbuffer(self) -> memoryview:
+        size = self.size
+        self._fill_bytes(size, relative=False)
+        return memoryview(self._buf)[:size]
+
     def save(self, filename: str):
-        with open(filename, "wb") as f:
-            f.write(self.stream)
+        with self.getbuffer() as data:
+            write_file(filename, data)
     
     def write_sub(self, other: typing.Self):
-        self.write_bytes(other.stream)
+        with other.getbuffer() as data:
+            self.write(data)
 
     def seek(self, offset: int, *, relative: bool = False):
+        # only remember how far we got; the buffer grows when something is written
+        if self._position > self._size:
+            self._size = self._position
+
         if relative:
             self._position += offset
         else:
             self._position = offset
-        
-        self._fill_bytes(0)
     
     def seek_rel(self, offset: int):
         self.seek(offset, relative=True)
 
     def align(self, alignment: int):
-        pos = self.position
-        delta = (-pos % alignment + alignment) % alignment
-        self.seek(delta, relative=True)
+        mask = alignment - 1
+        assert alignment & mask == 0, "alignment must be a power of 2"
+        delta = -self._position & mask
+        if delta:
+            self.seek_rel(delta)
 
     def _fill_bytes(self, offset: int, relative: bool = True):
-        bytes_to_add = offset - len(self.stream)
-        if relative:
-            bytes_to_add += self.position
-
-        if bytes_to_add > 0:
-            self.stream += bytearray(bytes_to_add)
+        target = self._position + offset if relative else offset
+        if target > len(self._buf):
+            self._buf.extend(bytes(target - len(self._buf)))
 
     def write(self, raw: bytes):
-        self._fill_bytes(len(raw))
-        for byte in raw:
-            self.stream[self._position] = byte
-            self._position += 1
+        if self._position > len(self._buf):
+            self._fill_bytes(0)
+        # covers appending, overwriting and straddling the end in one splice
+        end = self._position + len(raw)
+        self._buf[self._position:end] = raw
+        self._position = end
 
     def _write(self, fmt: str, value):
-        endianness = self.byte_order.value
-        raw = struct.pack(endianness + fmt, value)
+        s = self._structs[fmt]
+        self._fill_bytes(s.size)
+        s.pack_into(self._buf, self._position, value)
+        self._position += s.size
+
+    def _write_array(self, fmt: str, values: typing.Sequence):
+        raw = struct.pack(f"{self._endian}{len(values)}{fmt}", *values)
         self.write(raw)
 
+    def write_struct(self, s: struct.Struct, *values):
+        self._fill_bytes(s.size)
+        s.pack_into(self._buf, self._position, *values)
+        self._position += s.size
+
     def write_bool(self, value: bool):
         self._write("?", value)
 
@@ -80,31 +199,42 @@ class BinaryWriter:
         self._write("b", value)
 
     def write_u8(self, value: int):
-        self._write("B", value)
+        self._fill_bytes(1)
+        self._pack_u8(self._buf, self._position, value)
+        self._position += 1
 
     def write_s16(self, value: int):
         self._write("h", value)
 
     def write_u16(self, value: int):
-        self._write("H", value)
+        self._fill_bytes(2)
+        self._pack_u16(self._buf, self._position, value)
+        self._position += 2
 
     def write_u24(self, value: int):
-        if self.byte_order == ByteOrder.little:
-            self.write(struct.pack("<I", value)[:3])
-        else:
-            self.write(struct.pack(">I", value)[1:])
+        self.write(value.to_bytes(3, self._int_order))
 
     def write_s32(self, value: int):
         self._write("i", value)
 
     def write_u32(self, value: int):
-        self._write("I", value)
+        self._fill_bytes(4)
+        self._pack_u32(self._buf, self._position, value)
+        self._position += 4
 
     def write_s64(self, value: int):
         self._write("q", value)
 
     def write_u64(self, value: int):
-        self._write("Q", value)
+        self._fill_bytes(8)
+        self._pack_u64(self._buf, self._position, value)
+        self._position += 8
+
+    def write_u32s(self, values: typing.Sequence[int]):
+        self._write_array("I", values)
+
+    def write_u64s(self, values: typing.Sequence[int]):
+        self._write_array("Q", values)
 
     def write_f32(self, value: float):
         self._write("f", value)
@@ -116,12 +246,26 @@ class BinaryWriter:
         self.write(value)
     
     def write_string(self, value: str, *, max_len: int = -1):
+        encoded = value.encode("ascii")
         if max_len > 0:
-            value = value[:max_len]
-            self.write("{:\0<{max_len}}".format(value, max_len=max_len).encode("ascii"))
-        else:
-            self.write(value.encode("ascii"))
-
+            encoded = encoded[:max_len].ljust(max_len, b"\0")
+        self.write(encoded)
+
+
+def _coerce_int(value: typing.Any, msg: str) -> int:
+    # integers may be given as hex strings; check the exact JSON types first
+    t = type(value)
+    if t is int:
+        return value
+    if t is str:
+        return int(value, 16)
+    if isinstance(value, int):
+        return value
+    if t is float and value.is_integer() and not -(1 << 63) < value < (1 << 64):
+        # orjson decodes integers outside the i64/u64 range as floats; keep them
+        # as (out of range) integers so callers report the range, like json does
+        return int(value)
+    abort(msg)
 
 def json_read_value(json: dict, keys: str, default: typing.Any) -> (str, typing.Any):
     if isinstance(keys, str):
@@ -132,8 +276,8 @@ def json_read_value(json: dict, keys: str, default: typing.Any) -> (str, typing.
             return (key, json[key])
     
     if default is not None:
-        return (key[0], default)
-    abort(f"couldn't find key `{key[0]}`")
+        return (keys[0], default)
+    abort(f"couldn't find key `{keys[0]}`")
 
 def json_read_dict(json: dict, key: str, default: dict = None) -> dict:
     key, data = json_read_value(json, key, default)
@@ -158,13 +302,7 @@ def json_read_str(json: dict, key: str, max_len: int = -1, default: str = None)
 
 def json_read_int(json: dict, key: str, min_val: int, max_val: int, default: int = None) -> int:
     key, data = json_read_value(json, key, default)
-    if isinstance(data, int):
-        val = data
-    elif isinstance(data, str):
-        val = int(data, 16)
-    else:
-        abort(isinstance(data, (int, str)), f"`{key}` must be an integer")
-
+    val = _coerce_int(data, f"`{key}` must be an integer")
     abort_unless(min_val <= val <= max_val, f"`{key}` must be between {min_val:#x} and {max_val:#x}")
     return val
 
@@ -180,169 +318,248 @@ def json_read_u16(json: dict, key: str, default: int = None) -> int:
 def json_read_u8(json: dict, key: str, default: int = None) -> int:
     return json_read_int(json, key, 0, (1 << 8) - 1, default)
 
+_TYPE_NAMES = {dict: "a dict", list: "a list", bool: "a boolean", str: "a string"}
+
+def read_fields(json: dict, spec: dict) -> dict:
+    # spec maps key -> (type, min, max, default); for strings max is the max
+    # length, and a nested spec dict in place of the type reads a sub-dict
+    read_value = json_read_value
+    coerce_int = _coerce_int
+    fields = {}
+    for key, (type_, min_val, max_val, default) in spec.items():
+        key, data = read_value(json, key, default)
+        # error messages are only formatted once a check has actually failed
+        if type_ is int:
+            if type(data) is not int:
+                data = coerce_int(data, f"`{key}` must be an integer")
+            if not min_val <= data <= max_val:
+                abort(f"`{key}` must be between {min_val:#x} and {max_val:#x}")
+        elif isinstance(type_, dict):
+            if not isinstance(data, dict):
+                abort(f"`{key}` must be a dict")
+            data = read_fields(data, type_)
+        else:
+            if not isinstance(data, type_):
+                abort(f"`{key}` must be {_TYPE_NAMES[type_]}")
+            if type_ is str and 0 < max_val < len(data):
+                abort(f"string `{key}` must be less than {max_val} in length")
+        fields[key] = data
+    return fields
+
+
+DEPRECATED_KEYS = {
+    "title_id": "program_id",
+    "title_id_range_min": "program_id_range_min",
+    "title_id_range_max": "program_id_range_max",
+    "process_category": "version",
+}
+
+def rename_deprecated_keys(json: dict):
+    # the current name wins if both are given
+    for old in DEPRECATED_KEYS.keys() & json.keys():
+        json.setdefault(DEPRECATED_KEYS[old], json.pop(old))
 
-def write_sac(contents: dict) -> BinaryWriter:
-    writer = BinaryWriter()
+
+def write_sac(contents: dict) -> bytes:
     service_host = json_read_list(contents, "service_host")
     service_access = json_read_list(contents, "service_access")
-    for service in service_host:
-        abort_unless(isinstance(service, str), "services must be strings")
-        abort_unless(1 <= len(service) <= 8, "services must be between 1 and 8 chars long")
-
-        writer.write_u8(0x80 | (len(service) - 1))
-        writer.write_string(service)
+    services = service_host + service_access
+    abort_unless(all(isinstance(service, str) for service in services), "services must be strings")
+    abort_unless(all(1 <= len(service) <= 8 for service in services), "services must be between 1 and 8 chars long")
+
+    # each entry is a length byte (high bit set for hosted services) + the name
+    parts = [bytes((0x80 | (len(service) - 1),)) + service.encode("ascii") for service in service_host]
+    parts += [bytes((len(service) - 1,)) + service.encode("ascii") for service in service_access]
+    return b"".join(parts)
+
+
+def _kc_kernel_flags(caps: list[int], cap: dict):
+    value = json_read_dict(cap, "value")
+    cap = (1 << 3) - 1
+    cap |= json_read_int(value, "highest_thread_priority", 0, 63) << 4
+    cap |= json_read_int(value, "lowest_thread_priority", 0, 63) << 10
+    cap |= json_read_u8(value, "lowest_cpu_id") << 16
+    cap |= json_read_u8(value, "highest_cpu_id") << 24
+    caps.append(cap)
+
+def _kc_syscalls(caps: list[int], cap: dict):
+    value = json_read_dict(cap, "value")
+    vals = [_coerce_int(data, "syscalls must be integers") for data in value.values()]
+    abort_unless(
+        min(vals, default=0) >= 0 and max(vals, default=0) <= 0xbf,
+        "syscall values must be between 0 and 0xbf"
+    )
+
+    groups = [0] * 8
+    for val in vals:
+        idx, bit = divmod(val, 24)
+        groups[idx] |= 1 << bit
     
-    for service in service_access:
-        abort_unless(isinstance(service, str), "services must be strings")
-        abort_unless(1 <= len(service) <= 8, "services must be between 1 and 8 chars long")
-        
-        writer.write_u8(len(service) - 1)
-        writer.write_string(service)
+    caps.extend(
+        ((1 << 4) - 1) | (group << 5) | (idx << 29)
+        for idx, group in enumerate(groups)
+        if group
+    )
+
+def _kc_map(caps: list[int], cap: dict):
+    value = json_read_dict(cap, "value")
+
+    cap = (1 << 6) - 1
+    cap |= json_read_int(value, "address", 0, (1 << 24) - 1) << 7
+    cap |= (1 << 31) if json_read_bool(value, "is_ro") else 0
+    caps.append(cap)
+
+    cap = (1 << 6) - 1
+    cap |= json_read_int(value, "size", 0, (1 << 20) - 1) << 7
+    cap |= (1 << 31) if json_read_bool(value, "is_io") else 0
+    caps.append(cap)
+
+def _kc_map_page(caps: list[int], cap: dict):
+    value = json_read_int(cap, "value", 0, (1 << 24) - 1)
+    cap = (1 << 7) - 1
+    cap |= value << 8
+    caps.append(cap)
+
+def _kc_map_region(caps: list[int], cap: dict):
+    value = json_read_list(cap, "value")
+    abort_unless(len(value) <= 3, "`map_region` can have a maximum of 3 regions")
+    cap = (1 << 10) - 1
+    for i, region in enumerate(value):
+        abort_unless(isinstance(region, dict), "`map_region` entries must be dicts")
+        cap |= json_read_int(region, "region_type", 0, 3) << (11 + 7 * i)
+        cap |= (1 << (17 + 7 * i)) if json_read_bool(region, "is_ro") else 0
     
-    return writer
-
-
-def write_kc(contents: dict) -> BinaryWriter:
-    writer = BinaryWriter()
+    caps.append(cap)
+
+def _kc_irq_pair(caps: list[int], cap: dict):
+    value = json_read_list(cap, "value")
+    abort_unless(len(value) == 2, "`irq_pair` must contain 2 elements")
+    cap = (1 << 11) - 1
+    for i, irq in enumerate(value):
+        if irq is None:
+            irq_value = 0x3ff
+        else:
+            irq_value = _coerce_int(irq, "`irq_pair` values must be integers")
+            abort_unless(0 <= irq_value <= (1 << 10) - 1, f"`irq_pair` values must be between {0:#x} and {(1 << 10) - 1:#x}")
+
+        cap |= irq_value << (11 + i * 10)
+
+    caps.append(cap)
+
+def _kc_application_type(caps: list[int], cap: dict):
+    value = json_read_int(cap, "value", 0, 2, 0)
+    cap = (1 << 13) - 1
+    cap |= value << 14
+    caps.append(cap)
+
+def _kc_min_kernel_version(caps: list[int], cap: dict):
+    value = json_read_u16(cap, "value")
+    cap = (1 << 14) - 1
+    cap |= value << 15
+    caps.append(cap)
+
+def _kc_handle_table_size(caps: list[int], cap: dict):
+    value = json_read_int(cap, "value", 0, (1 << 10) - 1)
+    cap = (1 << 15) - 1
+    cap |= value << 16
+    caps.append(cap)
+
+def _kc_debug_flags(caps: list[int], cap: dict):
+    value = json_read_dict(cap, "value")
+    allow_debug = json_read_bool(value, "allow_debug", False)
+    force_debug = json_read_bool(value, "force_debug", False)
+    force_debug_prod = json_read_bool(value, "force_debug_prod", False)
+    abort_unless(
+        allow_debug + force_debug + force_debug_prod <= 1,
+        "only one of `allow_debug`, `force_debug`, or `force_debug_prod` can be set"
+    )
+
+    cap = (1 << 16) - 1
+    cap |= (1 << 17) if allow_debug else 0
+    cap |= (1 << 18) if force_debug_prod else 0
+    cap |= (1 << 19) if force_debug else 0
+    caps.append(cap)
+
+_KC_HANDLERS = {
+    "kernel_flags": _kc_kernel_flags,
+    "syscalls": _kc_syscalls,
+    "map": _kc_map,
+    "map_page": _kc_map_page,
+    "map_region": _kc_map_region,
+    "irq_pair": _kc_irq_pair,
+    "application_type": _kc_application_type,
+    "min_kernel_version": _kc_min_kernel_version,
+    "handle_table_size": _kc_handle_table_size,
+    "debug_flags": _kc_debug_flags,
+}
+
+def write_kc(contents: dict) -> bytes:
+    caps = []
     kernel_caps = json_read_list(contents, "kernel_capabilities")
-    for cap_idx, cap in enumerate(kernel_caps):
+    abort_unless(len(kernel_caps) <= 32, "too many kernel capabilities (max = 32)")
+    read_str = json_read_str
+    get_handler = _KC_HANDLERS.get
+    for cap in kernel_caps:
         abort_unless(isinstance(cap, dict), "kernel capabilities must be dicts")
-        abort_unless(cap_idx < 32, "too many kernel capabilities (max = 32)")
         
-        type_ = json_read_str(cap, "type")
-        if type_ == "kernel_flags":
-            value = json_read_dict(cap, "value")
-            cap = (1 << 3) - 1
-            cap |= json_read_int(value, "highest_thread_priority", 0, 63) << 4
-            cap |= json_read_int(value, "lowest_thread_priority", 0, 63) << 10
-            cap |= json_read_u8(value, "lowest_cpu_id") << 16
-            cap |= json_read_u8(value, "highest_cpu_id") << 24
-            writer.write_u32(cap)
-        elif type_ == "syscalls":
-            value = json_read_dict(cap, "value")
-            groups = [0] * 8
-            for name, data in value.items():
-                if isinstance(data, int):
-                    val = data
-                elif isinstance(data, str):
-                    val = int(data, 16)
-                else:
-                    abort(isinstance(data, (int, str)), f"syscalls must be integers")
-
-                abort_unless(0 <= val <= 0xbf, "syscall values must be between 0 and 0xbf")
-                groups[val // 24] |= 1 << (val % 24)
-            
-            for idx, group in enumerate(groups):
-                if group:
-                    cap = (1 << 4) - 1
-                    cap |= group << 5
-                    cap |= idx << 29
-                    writer.write_u32(cap)
-        elif type_ == "map":
-            value = json_read_dict(cap, "value")
-
-            cap = (1 << 6) - 1
-            cap |= json_read_int(value, "address", 0, (1 << 24) - 1) << 7
-            cap |= (1 << 31) if json_read_bool(value, "is_ro") else 0
-            writer.write_u32(cap)
-
-            cap = (1 << 6) - 1
-            cap |= json_read_int(value, "size", 0, (1 << 20) - 1) << 7
-            cap |= (1 << 31) if json_read_bool(value, "is_io") else 0
-            writer.write_u32(cap)
-        elif type_ == "map_page":
-            cap = (1 << 7) - 1
-            cap |= json_read_int(cap, "value", 0, (1 << 24) - 1) << 8
-            writer.write_u32(cap)
-        elif type_ == "map_region":
-            value = json_read_list(cap, "value")
-            abort_unless(len(value) <= 3, "`map_region` can have a maximum of 3 regions")
-            cap = (1 << 10) - 1
-            for i, region in enumerate(value):
-                abort_unless(isinstance(region, dict), "`map_region` entries must be dicts")
-                cap |= json_read_int(region, "region_type", 0, 3) << (11 + 7 * i)
-                cap |= (1 << (17 + 7 * i)) if json_read_bool(region, "is_ro") else 0
-            
-            writer.write_u32(cap)
-        elif type_ == "irq_pair":
-            value = json_read_list(cap, "value")
-            abort_unless(len(value) == 2, "`irq_pair` must contain 2 elements")
-            cap = (1 << 11) - 1
-            for i, irq in enumerate(value):
-                if irq is None:
-                    irq_value = 0x3ff
-                else:
-                    if isinstance(data, int):
-                        irq_value = data
-                    elif isinstance(data, str):
-                        irq_value = int(data, 16)
-                    else:
-                        abort(isinstance(data, (int, str)), f"`irq_pair` values must be a integers")
-
-                    abort_unless(0 <= val <= (1 << 10) - 1, f"`irq_pair` values must be between {0:#x} and {(1 << 10) - 1:#x}")
-
-                cap |= irq_value << (11 + i * 10)
-
-            writer.write_u32(cap)
-        elif type_ == "application_type":
-            value = json_read_int(cap, "value", 0, 2, 0)
-            cap = (1 << 13) - 1
-            cap |= value << 14
-            writer.write_u32(cap)
-        elif type_ == "min_kernel_version":
-            value = json_read_u16(cap, "value")
-            cap = (1 << 14) - 1
-            cap |= value << 15
-            writer.write_u32(cap)
-        elif type_ == "handle_table_size":
-            value = json_read_int(cap, "value", 0, (1 << 10) - 1)
-            cap = (1 << 15) - 1
-            cap |= value << 16
-            writer.write_u32(cap)
-        elif type_ == "debug_flags":
-            value = json_read_dict(cap, "value")
-            allow_debug = json_read_bool(value, "allow_debug", False)
-            force_debug = json_read_bool(value, "force_debug", False)
-            force_debug_prod = json_read_bool(value, "force_debug_prod", False)
-            abort_unless(
-                allow_debug + force_debug + force_debug_prod <= 1,
-                "only one of `allow_debug`, `force_debug`, or `force_debug_prod` can be set"
-            )
-
-            cap = (1 << 16) - 1
-            cap |= (1 << 17) if allow_debug else 0
-            cap |= (1 << 18) if force_debug_prod else 0
-            cap |= (1 << 19) if force_debug else 0
-            writer.write_u32(cap)
-        else:
+        type_ = read_str(cap, "type")
+        handler = get_handler(type_)
+        if handler is None:
             abort(f"unrecognised kernel capability type `{type_}`")
+        handler(caps, cap)
     
-    return writer
-
-
-def write_acid(contents: dict, sac_writer: BinaryWriter, kc_writer: BinaryWriter) -> BinaryWriter:
-    writer = BinaryWriter()
-
-    writer.write_bytes(b"\x00"*0x100) # RSA2048 signature
-    writer.write_bytes(b"\x00"*0x100) # RSA2048 public key
-
-    writer.write_string("ACID")
-    writer.seek_rel(4) # skip size for now
-    writer.seek_rel(4) # TODO: skipped version and unknown 0x209 thingy
-    
-    acid_flags = 0
-    acid_flags |= 0b00000001 if json_read_bool(contents, "is_retail") else 0
-    acid_flags |= 0b00000010 if json_read_bool(contents, "unqualified_approval", False) else 0
-    acid_flags |= json_read_int(contents, "pool_partition", 0, 3) << 2
-    writer.write_u32(acid_flags)
-    writer.write_u64(json_read_u64(contents, ("program_id_range_min", "title_id_range_min")))
-    writer.write_u64(json_read_u64(contents, ("program_id_range_max", "title_id_range_max")))
-    writer.seek_rel(0x20)
+    return struct.pack(f"<{len(caps)}I", *caps)
+
+
+FS_ACCESS_FIELDS = {
+    "permissions": (int, 0, (1 << 64) - 1, None),
+    "content_owner_ids": (list, None, None, []),
+    "save_data_owner_ids": (list, None, None, []),
+}
+
+ACID_FIELDS = {
+    "is_retail": (bool, None, None, None),
+    "unqualified_approval": (bool, None, None, False),
+    "pool_partition": (int, 0, 3, None),
+    "program_id_range_min": (int, 0, (1 << 64) - 1, None),
+    "program_id_range_max": (int, 0, (1 << 64) - 1, None),
+    "filesystem_access": (FS_ACCESS_FIELDS, None, None, None),
+}
+
+ACID_HEADER = struct.Struct(
+    "<"
+    "512x" # RSA2048 signature + public key
+    "4s" # magic
+    "I" # size
+    "4x" # TODO: skipped version and unknown 0x209 thingy
+    "I" # flags
+    "QQ" # program ID range
+    "32x" # section offsets + sizes, filled in later
+)
+
+ACID_FLAGS = (
+    (0b00000001, "is_retail"),
+    (0b00000010, "unqualified_approval"),
+)
+
+def write_acid(fields: dict, sac: bytes, kc: bytes) -> BinaryWriter:
+    writer = BinaryWriter.acquire()
+    writer.reserve(0x300 + len(sac) + len(kc)) # header + FAC + padding
+
+    acid_flags = sum(bit for bit, key in ACID_FLAGS if fields[key])
+    acid_flags |= fields["pool_partition"] << 2
+    writer.write_struct(
+        ACID_HEADER,
+        b"ACID",
+        0, # size, filled in below
+        acid_flags,
+        fields["program_id_range_min"],
+        fields["program_id_range_max"],
+    )
     
     # ACID - Filesystem Access Control
 
-    fs_access = json_read_dict(contents, "filesystem_access")
-    fs_permissions = json_read_u64(fs_access, "permissions")
+    fs_permissions = fields["filesystem_access"]["permissions"]
 
     fac_offset = writer.position
     writer.write_u8(1) # version
@@ -360,46 +577,52 @@ def write_acid(contents: dict, sac_writer: BinaryWriter, kc_writer: BinaryWriter
 
     writer.align(0x10)
     sac_offset = writer.position
-    sac_size = len(sac_writer.stream)
+    sac_size = len(sac)
     writer.seek(sac_offset)
-    writer.write_sub(sac_writer)
+    writer.write_bytes(sac)
 
     # ACID - Kernel Capabilities
 
     writer.align(0x10)
     kc_offset = writer.position
-    kc_size = len(kc_writer.stream)
+    kc_size = len(kc)
     writer.seek(kc_offset)
-    writer.write_sub(kc_writer)
+    writer.write_bytes(kc)
 
     acid_size = writer.position
 
     writer.seek(0x204)
     writer.write_u32(acid_size - 0x100)
     writer.seek(0x220)
-    writer.write_u32(fac_offset)
-    writer.write_u32(fac_size)
-    writer.write_u32(sac_offset)
-    writer.write_u32(sac_size)
-    writer.write_u32(kc_offset)
-    writer.write_u32(kc_size)
+    writer.write_u32s((fac_offset, fac_size, sac_offset, sac_size, kc_offset, kc_size))
 
-    print(hex(len(writer.stream)))
+    print(hex(writer.size))
 
     return writer
 
 
-def write_aci(contents: dict, sac_writer: BinaryWriter, kc_writer: BinaryWriter) -> BinaryWriter:
-    writer = BinaryWriter()
+SAVE_DATA_OWNER_FIELDS = {
+    "accessibility": (int, 1, 3, None),
+    "id": (int, 0, (1 << 64) - 1, None),
+}
+
+ACI_FIELDS = {
+    "program_id": (int, 0, (1 << 64) - 1, None),
+    "filesystem_access": (FS_ACCESS_FIELDS, None, None, None),
+}
+
+def write_aci(fields: dict, sac: bytes, kc: bytes) -> BinaryWriter:
+    writer = BinaryWriter.acquire()
+    writer.reserve(0x80 + len(sac) + len(kc)) # header + FAH + padding
 
-    fs_access = json_read_dict(contents, "filesystem_access")
-    content_owner_ids = json_read_list(fs_access, "content_owner_ids", [])
-    save_data_owner_ids = json_read_list(fs_access, "save_data_owner_ids", [])
-    fs_permissions = json_read_u64(fs_access, "permissions")
+    fs_access = fields["filesystem_access"]
+    content_owner_ids = fs_access["content_owner_ids"]
+    save_data_owner_ids = fs_access["save_data_owner_ids"]
+    fs_permissions = fs_access["permissions"]
 
     writer.write_string("ACI0")
     writer.seek_rel(0xc) # reserved
-    writer.write_u64(json_read_u64(contents, ("program_id", "title_id")))
+    writer.write_u64(fields["program_id"])
     writer.seek_rel(0x8) # reserved
     writer.seek_rel(0x20) # skip over offsets and sizes for now
 
@@ -413,16 +636,12 @@ def write_aci(contents: dict, sac_writer: BinaryWriter, kc_writer: BinaryWriter)
     coi_offset = writer.position
     if len(content_owner_ids):
         writer.write_u32(len(content_owner_ids))
-    for coi in content_owner_ids:
-        if isinstance(coi, int):
-            val = coi
-        elif isinstance(coi, str):
-            val = int(coi, 16)
-        else:
-            abort(isinstance(coi, (int, str)), f"`content_owner_ids` entries must be integers")
-        abort_unless(0 <= val <= (1 << 64) - 1, f"`content_owner_ids` entries must be between 0 and {(1 << 64) - 1:#x}")
-
-        writer.write_u64(val)
+    coi_vals = [_coerce_int(coi, "`content_owner_ids` entries must be integers") for coi in content_owner_ids]
+    abort_unless(
+        min(coi_vals, default=0) >= 0 and max(coi_vals, default=0) <= (1 << 64) - 1,
+        f"`content_owner_ids` entries must be between 0 and {(1 << 64) - 1:#x}"
+    )
+    writer.write_u64s(coi_vals)
     coi_size = writer.position - coi_offset
  
     sdoi_offset = writer.position
@@ -432,14 +651,13 @@ def write_aci(contents: dict, sac_writer: BinaryWriter, kc_writer: BinaryWriter)
     sdoi_ids = []
     for sdoi in save_data_owner_ids:
         abort_unless(isinstance(sdoi, dict), "`save_data_owner_ids` entries must be dicts")
-        sdoi_accessibilities.append(json_read_int(sdoi, "accessibility", 1, 3))
-        sdoi_ids.append(json_read_u64(sdoi, "id"))
+        sdoi = read_fields(sdoi, SAVE_DATA_OWNER_FIELDS)
+        sdoi_accessibilities.append(sdoi["accessibility"])
+        sdoi_ids.append(sdoi["id"])
     
-    for accessibility in sdoi_accessibilities:
-        writer.write_u8(accessibility)
+    writer.write_bytes(bytes(sdoi_accessibilities))
     writer.align(4)
-    for id_ in sdoi_ids:
-        writer.write_u64(id_)
+    writer.write_u64s(sdoi_ids)
     sdoi_size = writer.position - sdoi_offset
 
     fah_size = writer.position - fah_offset
@@ -454,62 +672,104 @@ def write_aci(contents: dict, sac_writer: BinaryWriter, kc_writer: BinaryWriter)
     writer.seek(fah_offset + fah_size)
     writer.align(0x10)
     sac_offset = writer.position
-    writer.write_sub(sac_writer)
+    writer.write_bytes(sac)
 
     # ACI - Kernel Capabilities
 
     writer.align(0x10)
     kc_offset = writer.position
-    writer.write_sub(kc_writer)
+    writer.write_bytes(kc)
 
     aci_size = writer.position
 
     writer.seek(0x20)
-    writer.write_u32(fah_offset)
-    writer.write_u32(fah_size)
-    writer.write_u32(sac_offset)
-    writer.write_u32(len(sac_writer.stream))
-    writer.write_u32(kc_offset)
-    writer.write_u32(len(kc_writer.stream))
+    writer.write_u32s((
+        fah_offset, fah_size,
+        sac_offset, len(sac),
+        kc_offset, len(kc),
+    ))
 
     return writer
 
 
-def write_meta(contents: dict) -> BinaryWriter:
-    writer = BinaryWriter()
-
-    writer.write_string("META")
-    writer.write_u32(json_read_u32(contents, "signature_key_generation", 0))
-    writer.seek_rel(0x4) # reserved
-
-    cap = 0
-    cap |= 0b00000001 if json_read_bool(contents, "is_64_bit") else 0
-    cap |= json_read_int(contents, "address_space_type", 0, 3) << 1
-    cap |= 0b00010000 if json_read_bool(contents, "optimize_memory_allocation", False) else 0
-    cap |= 0b00100000 if json_read_bool(contents, "disable_device_address_space_merge", False) else 0
-    cap |= 0b01000000 if json_read_bool(contents, "enable_alias_region_extra_size", False) else 0
-    cap |= 0b10000000 if json_read_bool(contents, "prevent_code_reads", False) else 0
-    writer.write_u8(cap)
-    writer.seek(0xe)
-    writer.write_u8(json_read_int(contents, "main_thread_priority", 0, 0x3f))
-    writer.write_u8(json_read_u8(contents, "default_cpu_id"))
-    writer.seek(0x14)
-    writer.write_u32(json_read_int(contents, "system_resource_size", 0, 0x1fe00000, 0))
-    writer.write_u32(json_read_u32(contents, "version", 0))
-
-    main_thread_stack_size = json_read_u32(contents, "main_thread_stack_size")
+META_FIELDS = {
+    "signature_key_generation": (int, 0, (1 << 32) - 1, 0),
+    "is_64_bit": (bool, None, None, None),
+    "address_space_type": (int, 0, 3, None),
+    "optimize_memory_allocation": (bool, None, None, False),
+    "disable_device_address_space_merge": (bool, None, None, False),
+    "enable_alias_region_extra_size": (bool, None, None, False),
+    "prevent_code_reads": (bool, None, None, False),
+    "main_thread_priority": (int, 0, 0x3f, None),
+    "default_cpu_id": (int, 0, (1 << 8) - 1, None),
+    "system_resource_size": (int, 0, 0x1fe00000, 0),
+    "version": (int, 0, (1 << 32) - 1, 0),
+    "main_thread_stack_size": (int, 0, (1 << 32) - 1, None),
+    "name": (str, None, 0x10, None),
+}
+
+META_HEADER = struct.Struct(
+    "<"
+    "4s" # magic
+    "I" # signature key generation
+    "4x" # reserved
+    "B" # flags
+    "x" # reserved
+    "B" # main thread priority
+    "B" # default CPU ID
+    "4x" # reserved
+    "I" # system resource size
+    "I" # version
+    "I" # main thread stack size
+    "16s" # name
+    "16x" # product code
+    "48x" # reserved
+    "16x" # ACI/ACID offsets + sizes, filled in later
+)
+
+META_SECTIONS = struct.Struct("<4I") # ACI offset + size, ACID offset + size
+
+META_FLAGS = (
+    (0b00000001, "is_64_bit"),
+    (0b00010000, "optimize_memory_allocation"),
+    (0b00100000, "disable_device_address_space_merge"),
+    (0b01000000, "enable_alias_region_extra_size"),
+    (0b10000000, "prevent_code_reads"),
+)
+
+def write_meta(fields: dict) -> BinaryWriter:
+    writer = BinaryWriter.acquire()
+
+    main_thread_stack_size = fields["main_thread_stack_size"]
     abort_unless(main_thread_stack_size & 0xfff == 0, "`main_thread_stack_size` must be aligned to 0x1000")
-    writer.write_u32(main_thread_stack_size)
 
-    name = json_read_str(contents, "name", max_len=0x10)
-    writer.write_string(name, max_len=0x10)
-    writer.write_bytes(b"\0"*16) # product code
-    writer.seek_rel(0x30) # reserved
-    writer.seek_rel(0x10) # skip ACI/ACID offsets + sizes for now
+    cap = sum(bit for bit, key in META_FLAGS if fields[key])
+    cap |= fields["address_space_type"] << 1
+
+    writer.write_struct(
+        META_HEADER,
+        b"META",
+        fields["signature_key_generation"],
+        cap,
+        fields["main_thread_priority"],
+        fields["default_cpu_id"],
+        fields["system_resource_size"],
+        fields["version"],
+        main_thread_stack_size,
+        fields["name"].encode("ascii"),
+    )
 
     return writer
 
 
+NPDM_FIELDS = {**META_FIELDS, **ACID_FIELDS, **ACI_FIELDS}
+
+@dataclasses.dataclass
+class Section:
+    writer: BinaryWriter
+    offset: int = 0
+    size: int = 0
+
 def main():
     parser = argparse.ArgumentParser(description="generate NPDM file from JSON")
     parser.add_argument("infile")
@@ -518,46 +778,46 @@ def main():
 
     args = parser.parse_args()
 
-    with open(args.infile) as f:
-        contents = json.load(f)
+    with open(args.infile, "rb") as f:
+        data = f.read()
+    contents = json_loads(data)
+    abort_unless(isinstance(contents, dict), "top level must be a dict")
+    rename_deprecated_keys(contents)
+    fields = read_fields(contents, NPDM_FIELDS)
     
-    writer = BinaryWriter()
-
-    sac_writer = write_sac(contents)
-    kc_writer = write_kc(contents)
-
-    # META section
-
-    meta_writer = write_meta(contents)
-    meta_size = len(meta_writer.stream)
-    writer.write_sub(meta_writer)
-
-    # ACID section
-
-    writer.seek(meta_size)
-    writer.align(0x10)
-    acid_offset = writer.position
-    acid_writer = write_acid(contents, sac_writer, kc_writer)
-    acid_size = len(acid_writer.stream)
-    writer.write_sub(acid_writer)
-
-    # ACI section
-
-    writer.align(0x10)
-    aci_offset = writer.position
-    aci_writer = write_aci(contents, sac_writer, kc_writer)
-    aci_size = len(aci_writer.stream)
-    writer.write_sub(aci_writer)
-
-    # write ACI/ACID offsets + size into META
-
-    writer.seek(0x70)
-    writer.write_u32(aci_offset)
-    writer.write_u32(aci_size)
-    writer.write_u32(acid_offset)
-    writer.write_u32(acid_size)
-
-    writer.save(args.outfile)
+    sac = write_sac(contents)
+    kc = write_kc(contents)
+
+    sections = []
+    try:
+        meta = Section(write_meta(fields))
+        sections.append(meta)
+        acid = Section(write_acid(fields, sac, kc))
+        sections.append(acid)
+        aci = Section(write_aci(fields, sac, kc))
+        sections.append(aci)
+
+        # lay out the sections first so the output is only allocated once
+
+        end = 0
+        for section in sections:
+            section.offset = align_up(end, 0x10)
+            section.size = section.writer.size
+            end = section.offset + section.size
+
+        out = bytearray(end)
+        with memoryview(out) as view:
+            for section in sections:
+                with section.writer.getbuffer() as data:
+                    view[section.offset:section.offset + section.size] = data
+
+            # write ACI/ACID offsets + size into META
+            META_SECTIONS.pack_into(view, meta.offset + 0x70, aci.offset, aci.size, acid.offset, acid.size)
+
+            write_file(args.outfile, view)
+    finally:
+        for section in sections:
+            section.writer.release()
 
 if __name__ == "__main__":
     main()